@@ -1,22 +1,49 @@
 from __future__ import annotations
-from typing import List, Dict, Tuple
+from typing import List, Tuple
 import os
 
+import numpy as np
+import pandas as pd
 import wntr
 
+# status 码 0/1/2 -> 字符串；下标 3 留给无法识别的值
+_STATUS_MAP = {0: "CLOSED", 1: "OPEN", 2: "ACTIVE"}
+_STATUS_LABELS = np.array([_STATUS_MAP[0], _STATUS_MAP[1], _STATUS_MAP[2], "UNKNOWN"], dtype=object)
 
-def run_wntr_baseline(inp_path: str, dt_s: int, t_end_s: int) -> Tuple[List[Dict], List[str]]:
+
+def _status_from_raw(raw_val) -> str:
+    """WNTR link status 数值 -> OPEN/CLOSED/ACTIVE 字符串"""
+    if isinstance(raw_val, str):
+        return raw_val.upper()
+    try:
+        val = int(round(float(raw_val)))
+    except Exception:
+        return str(raw_val)
+    return _STATUS_MAP.get(val) or str(raw_val)
+
+
+def _decode_status_column(raw_vals: np.ndarray) -> List[str]:
+    """整列 status 数值一次性查表解码；非数值列退回逐个 _status_from_raw"""
+    if raw_vals.dtype.kind not in "biuf":
+        return [_status_from_raw(v) for v in raw_vals]
+    codes = np.rint(raw_vals.astype(np.float64))
+    valid = np.isfinite(codes) & (codes >= 0) & (codes <= 2)
+    labels = _STATUS_LABELS[np.where(valid, codes, 3).astype(np.int8)]
+    # 越界/NaN 保持原来的字符串化行为
+    for i in np.flatnonzero(~valid):
+        labels[i] = _status_from_raw(raw_vals[i])
+    return labels.tolist()
+
+
+def run_wntr_baseline(inp_path: str, dt_s: int, t_end_s: int) -> Tuple[List[int], List[float], List[List[str]], List[str]]:
     """
-    一次性跑完 WNTR 仿真（不做 step-by-step），返回 time series:
-      [
-        {
-          "t": 0,
-          "tank_level": <float>,
-          "<pump_name>_status": "OPEN|CLOSED|ACTIVE|UNKNOWN",
-          ...
-        },
-        ...
-      ]
+    一次性跑完 WNTR 仿真（不做 step-by-step），按列返回 time series:
+      times:       [0, dt, 2*dt, ...]
+      levels:      [<float>, ...]                       与 times 一一对应
+      statuses:    [[<PUMP1 status>, ...], [...], ...]  每台泵一列，顺序同 pump_names，
+                   取值 "OPEN|CLOSED|ACTIVE|UNKNOWN"
+      pump_names:  [<pump_name>, ...]
+    按列返回（而不是每个时刻一个 dict），调用方可以直接 zip(times, levels, *statuses) 逐行写出。
     注意：这里的 tank_level 是“水位 level（相对标高）”，不是 head。
           level = head - elevation
     """
@@ -45,45 +72,24 @@ def run_wntr_baseline(inp_path: str, dt_s: int, t_end_s: int) -> Tuple[List[Dict
 
     head_series = head_df[tank_name]
     times = list(range(0, int(t_end_s) + 1, int(dt_s)))
-    series: List[Dict] = []
-
-    def _pump_status_at_time(pump: str, t: int) -> str:
-        if pump_status_df is None or pump not in pump_status_df.columns:
-            return "UNKNOWN"
-        status_series = pump_status_df[pump]
-        idx = status_series.index.get_indexer([t], method="nearest")
-        if idx.size == 0 or idx[0] == -1:
-            return "UNKNOWN"
-        raw_val = status_series.iloc[idx[0]]
-        if isinstance(raw_val, str):
-            return raw_val.upper()
-        try:
-            val = int(round(float(raw_val)))
-        except Exception:
-            return str(raw_val)
-        if val == 1:
-            return "OPEN"
-        if val == 0:
-            return "CLOSED"
-        if val == 2:
-            return "ACTIVE"
-        return str(raw_val)
+    times_idx = pd.Index(times)
+
+    # 一次性按最近时刻对齐到输出时间轴（每列一次二分查找，而不是每个 t 一次 get_indexer）
+    if head_series.empty:
+        levels = [0.0] * len(times)
+    else:
+        levels = (head_series.reindex(times_idx, method="nearest").astype(float) - elev).tolist()
 
-    for t in times:
-        idx = head_series.index.get_indexer([t], method="nearest")
-        if idx.size == 0 or idx[0] == -1:
-            level = 0.0
-        else:
-            head_val = float(head_series.iloc[idx[0]])
-            level = head_val - elev
-        row: Dict = {"t": int(t), "tank_level": float(level)}
-        for pump in pump_names:
-            row[f"{pump}_status"] = _pump_status_at_time(pump, t)
-        series.append(row)
+    statuses: List[List[str]] = []
+    for pump in pump_names:
+        if pump_status_df is None or pump not in pump_status_df.columns or pump_status_df.empty:
+            statuses.append(["UNKNOWN"] * len(times))
+            continue
+        raw_vals = pump_status_df[pump].reindex(times_idx, method="nearest").to_numpy()
+        statuses.append(_decode_status_column(raw_vals))
 
     # ✅ sanity check：如果 level 明显超出 (min,max) 很多，说明变量取错了
-    if series:
-        levels = [p["tank_level"] for p in series]
+    if levels:
         lvl_min, lvl_max = min(levels), max(levels)
         # 给一点宽容：允许略微超出
         if max_level > 0 and (lvl_max > max_level + 5 or lvl_min < min_level - 5):
@@ -94,4 +100,4 @@ def run_wntr_baseline(inp_path: str, dt_s: int, t_end_s: int) -> Tuple[List[Dict
                 f"elevation={elev:.3f}. Check whether you are using head vs level."
             )
 
-    return series, pump_names
+    return times, levels, statuses, pump_names
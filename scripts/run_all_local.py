@@ -1,23 +1,60 @@
-import subprocess
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
+import helics as h
 
-def main():
-    # 1) 起 broker
-    broker = subprocess.Popen(["helics_broker", "-f", "2", "--coretype=zmq", "--port=23404"])
-    time.sleep(1.0)
+sys.path.append("src")
 
+from common.config import load_config
+from ctrl_fed.federate import run_ctrl_federate
+from phys_fed.federate import run_phys_federate
 
-    # 2) 起两个 federate
-    phys = subprocess.Popen([sys.executable, "scripts/run_phys.py", "--config", "config/minitown.yaml"])
-    ctrl = subprocess.Popen([sys.executable, "scripts/run_ctrl.py", "--config", "config/minitown.yaml"])
+CONFIG_PATH = "config/minitown.yaml"
+# 单个 federate 的最长墙钟时间（秒）；超时按失败处理，避免整个进程挂死
+RESULT_TIMEOUT_S = 600.0
 
-    # 3) 等待结束
-    phys.wait()
-    ctrl.wait()
-    broker.terminate()
+
+def _global_error(broker, msg: str) -> None:
+    # pyhelics 的 helicsBrokerGlobalError 只收 bytes
+    h.helicsBrokerGlobalError(broker, 1, msg.encode("utf-8", "replace"))
+
+
+def _guarded(broker, name: str, fn, *args, **kwargs):
+    """跑一个 federate；出错时先在 broker 上发 global error 让对方也退出，再把异常抛回去。"""
+    try:
+        return fn(*args, **kwargs)
+    except BaseException as exc:
+        _global_error(broker, f"[{name}] {type(exc).__name__}: {exc}")
+        raise
+
+
+def main(config_path: str = CONFIG_PATH, timeout_s: float = RESULT_TIMEOUT_S):
+    # 端口与 federate 一致，取自配置 helics.broker.port
+    broker_port = load_config(config_path).get("helics", {}).get("broker", {}).get("port", 23404)
+
+    # 1) 在本进程内起 broker：两个 federate 都连到它
+    broker = h.helicsCreateBroker("zmq", "", f"-f 2 --port={broker_port}")
+    if not h.helicsBrokerIsConnected(broker):
+        raise SystemExit("failed to start HELICS broker")
+
+    # 2) 两个 federate 作为线程；phys 不关库，由这里统一收尾
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = {
+            "phys_fed": pool.submit(_guarded, broker, "phys_fed", run_phys_federate, config_path, close_library=False),
+            "ctrl_fed": pool.submit(_guarded, broker, "ctrl_fed", run_ctrl_federate, config_path),
+        }
+        # 3) 等待结束（有异常则在这里抛出）；超时也发 global error，把两边都放出来
+        for name, fut in futures.items():
+            try:
+                fut.result(timeout=timeout_s)
+            except FutureTimeout:
+                _global_error(broker, f"[{name}] no result after {timeout_s:g} s")
+                raise
+
+    h.helicsBrokerWaitForDisconnect(broker, -1)
+    h.helicsBrokerFree(broker)
+    h.helicsCloseLibrary()
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else CONFIG_PATH)
@@ -1,10 +1,62 @@
+import os
 import subprocess
 import sys
+import tempfile
 
+sys.path.append("src")
 
-def main():
+CONFIG_PATH = "config/minitown.yaml"
+INP_PATH = "data/minitown.inp"
+
+
+def check_plant_variable_dt():
+    """dt 逐步变化（phys_fed 攒批推进时就是这样）时，Toolkit plant 必须正好停在累计时刻上"""
+    from phys_fed.wntr_plant import WNTRPlant
+
+    plant = WNTRPlant(INP_PATH, {"tank_level": ["TANK"]}, {"pumps": ["PUMP1", "PUMP2"]}, dt=900)
+    plant.reset()
+    expected = 0
+    for dt in (900, 1800, 900, 2700, 300, 3600, 600, 4500, 900, 7200, 900):
+        plant.step(dt, {"pumps": {}})
+        expected += dt
+        if plant.sim_time != expected:
+            raise SystemExit(f"smoke test failed: plant time {plant.sim_time} != {expected} after dt={dt}")
+    plant.close()
+
+
+def check_sim_plant_batched():
+    """
+    WNTRSimPlant 每步从 0 重跑：按 phys_fed 攒批的方式变步长推进时，
+    每个批末的水位必须与固定 900 s 步长逐步推进的结果一致
+    """
+    from phys_fed.wntr_plant import WNTRSimPlant
+
+    def make_plant():
+        return WNTRSimPlant(INP_PATH, {"tank_level": ["TANK"]}, {"pumps": ["PUMP1", "PUMP2"]}, dt=900)
+
+    batches = (900, 1800, 900, 2700, 3600, 900, 1800, 900, 3600)
+    fixed = make_plant()
+    fixed.reset()
+    expected = {}
+    for i in range(sum(batches) // 900):
+        expected[(i + 1) * 900] = fixed.step(900, {"pumps": {}}).tank_level["TANK"]
+
+    plant = make_plant()
+    plant.reset()
+    t = 0
+    for dt in batches:
+        t += dt
+        level = plant.step(dt, {"pumps": {}}).tank_level["TANK"]
+        if abs(level - expected[t]) > 1e-9:
+            raise SystemExit(f"smoke test failed: batched wntr level {level} != {expected[t]} at t={t}")
+
+
+def run_federation(config_path=None):
+    cmd = [sys.executable, "scripts/run_all_local.py"]
+    if config_path:
+        cmd.append(config_path)
     result = subprocess.run(
-        [sys.executable, "scripts/run_all_local.py"],
+        cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
@@ -17,5 +69,29 @@ def main():
         raise SystemExit("smoke test failed: missing 'finished' marker in output")
 
 
+def run_batched_federation(backend):
+    """打开 phys_max_batch_s 攒批推进再跑一遍；phys_fed 会检查 plant 时钟与 HELICS 时刻是否对齐"""
+    import yaml
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    cfg["sim"]["phys_max_batch_s"] = 4 * cfg["sim"]["dt_phys_s"]
+    cfg["sim"]["plant_backend"] = backend
+    with tempfile.TemporaryDirectory(prefix="smoke_") as tmp:
+        path = os.path.join(tmp, "batched.yaml")
+        with open(path, "w", encoding="utf-8") as f:
+            yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+        run_federation(path)
+
+
+def main():
+    check_plant_variable_dt()
+    check_sim_plant_batched()
+    # 先跑攒批版本，默认配置最后跑，output/ 里留下的是默认配置的结果
+    for backend in ("toolkit", "wntr"):
+        run_batched_federation(backend)
+    run_federation()
+
+
 if __name__ == "__main__":
     main()
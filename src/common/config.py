@@ -0,0 +1,40 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+
+import yaml
+
+# 有 libyaml 时用 C 实现的 CSafeLoader，否则退回纯 Python 的 SafeLoader
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_config(config_path: str) -> Dict[str, Any]:
+    with open(config_path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+def normalize_sensor_entry(entry: Any, default_tank: str = "TANK") -> Tuple[str, str]:
+    """
+    sensors.tank_level 的一项 -> (tank_id, topic)。
+    兼容 {"tank": "TANK", "topic": ...} 或直接写 tank 名字符串；缺 topic 时用 phys/sensors/<tank>。
+    """
+    if isinstance(entry, dict):
+        tank_id = entry.get("tank") or default_tank
+        topic = entry.get("topic")
+    else:
+        tank_id = str(entry) if entry else default_tank
+        topic = None
+    return str(tank_id), topic or f"phys/sensors/{tank_id}"
+
+
+def normalize_pump_entry(entry: Any, default_pump: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    actuators.pumps 的一项 -> (pump_name, topic)。
+    topic 未配置时返回 None，由调用方决定跳过还是用 ctrl/commands/<pump> 兜底。
+    """
+    if isinstance(entry, dict):
+        pump_name = entry.get("pump") or default_pump
+        topic = entry.get("topic")
+    else:
+        pump_name = str(entry) if entry else default_pump
+        topic = None
+    return (str(pump_name) if pump_name else None), (topic or None)
@@ -0,0 +1,26 @@
+from __future__ import annotations
+import sys
+from typing import List, Optional, TextIO
+
+
+class BufferedLog:
+    """
+    热循环里的调试输出先攒在内存里，满 flush_every 行再一次性写出，
+    避免每条 print 都加锁 + 系统调用。循环结束后记得 flush()。
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, flush_every: int = 100):
+        self.stream = stream if stream is not None else sys.stdout
+        self.flush_every = flush_every
+        self._lines: List[str] = []
+
+    def write(self, line: str) -> None:
+        self._lines.append(line)
+        if len(self._lines) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            self.stream.write("\n".join(self._lines) + "\n")
+            self._lines.clear()
+        self.stream.flush()
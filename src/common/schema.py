@@ -1,6 +1,8 @@
 from __future__ import annotations
+import json
+import math
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Tuple
 
 
 @dataclass
@@ -30,3 +32,32 @@ class ActuatorCommand:
         pumps = d.get("pumps", {}) or {}
         # 允许 OPEN/CLOSED 字符串（或其他可转成字符串的值）
         return ActuatorCommand(pumps={str(k): str(v) for k, v in pumps.items()})
+
+
+def pump_cmd_prefix(pump: str) -> str:
+    """
+    单泵命令 JSON 的固定前缀，拼上 json.dumps(state) + "}}" 即得到与
+    json.dumps(ActuatorCommand(pumps={pump: state}).to_dict(), ensure_ascii=False) 相同的字符串。
+    """
+    return '{"pumps": {' + json.dumps(str(pump), ensure_ascii=False) + ": "
+
+
+def sensor_payload_format(tanks: Iterable[str]) -> str:
+    """
+    给定 tank 名单的传感器 JSON %-模板，每个 tank 一个 %r 占位（按名单顺序填 float）。
+    值都是有限数时结果与 json.dumps(SensorSnapshot(tank_level=...).to_dict(), ensure_ascii=False) 相同；
+    NaN/inf 会被 %r 写成 nan/inf（json.loads 不认），填值请用 render_sensor_payload。
+    """
+    fields = ", ".join(json.dumps(str(k), ensure_ascii=False).replace("%", "%%") + ": %r" for k in tanks)
+    return '{"tank_level": {' + fields + "}}"
+
+
+def render_sensor_payload(fmt: str, tanks: List[str], values: Tuple[float, ...]) -> str:
+    """
+    用 sensor_payload_format 的模板填入各 tank 水位。有非有限值（NaN/inf）时退回 json.dumps，
+    输出 NaN/Infinity，与直接序列化 SensorSnapshot 一致。
+    """
+    # 和为有限数 <=> 每个值都有限（极端大值相加溢出时也只是多走一次 json.dumps）
+    if math.isfinite(sum(values)):
+        return fmt % values
+    return json.dumps(SensorSnapshot(tank_level=dict(zip(tanks, values))).to_dict(), ensure_ascii=False)
@@ -1,15 +1,16 @@
 from __future__ import annotations
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 import helics as h
-import yaml
 
-from common.schema import SensorSnapshot, ActuatorCommand
+from common.config import load_config, normalize_sensor_entry
+from common.logbuf import BufferedLog
+from common.schema import pump_cmd_prefix
 
 
 def run_ctrl_federate(config_path: str) -> None:
-    cfg = yaml.safe_load(open(config_path, "r", encoding="utf-8"))
+    cfg = load_config(config_path)
     sim_cfg = cfg.get("sim", {})
     helics_cfg = cfg.get("helics", {})
     dt = float(sim_cfg.get("dt_phys_s"))
@@ -18,10 +19,7 @@ def run_ctrl_federate(config_path: str) -> None:
 
     sensors_cfg = cfg.get("sensors", {}).get("tank_level", [])
     sensor_entry = sensors_cfg[0] if sensors_cfg else {}
-    tank_id = sensor_entry.get("tank") if isinstance(sensor_entry, dict) else str(sensor_entry) if sensor_entry else "TANK"
-    sensor_topic = sensor_entry.get("topic") if isinstance(sensor_entry, dict) else None
-    if not sensor_topic:
-        sensor_topic = f"phys/sensors/{tank_id}"
+    tank_id, sensor_topic = normalize_sensor_entry(sensor_entry)
 
     plc_cfgs: List[Dict[str, Any]] = []
     for plc in cfg.get("plcs", []):
@@ -69,47 +67,78 @@ def run_ctrl_federate(config_path: str) -> None:
     h.helicsFederateEnterExecutingMode(fed)
 
     t = 0.0
-    last_snap = SensorSnapshot(tank_level={})
+    # 最新的 {tank: level}，收到传感器载荷时原地更新，不再每次重建 SensorSnapshot
+    last_levels: Dict[str, float] = {}
     last_state: Dict[str, str] = {plc["pump"]: plc["initial"] for plc in plc_cfgs}
     step_count = 0
+    log = BufferedLog()
+
+    # 热循环里用到的 HELICS/json 函数先绑定到局部名，省掉每步的模块属性查找
+    request_time = h.helicsFederateRequestTime
+    input_is_updated = h.helicsInputIsUpdated
+    input_get_string = h.helicsInputGetString
+    publish_string = h.helicsPublicationPublishString
+    json_dumps = json.dumps
+    json_loads = json.loads
+    # 每个 PLC 的规则预先压成元组，循环里直接解包，不再逐步查 dict；
+    # 命令 schema 固定为 {"pumps": {pump: state}}，直接拼字符串，不再构造 ActuatorCommand
+    plc_rules: List[Tuple[str, float, float, str, str, Optional[h.HelicsPublication], str]] = [
+        (
+            plc["pump"],
+            plc["below"],
+            plc["above"],
+            plc["open_val"],
+            plc["closed_val"],
+            pubs.get(plc["pump"]),
+            pump_cmd_prefix(plc["pump"]),
+        )
+        for plc in plc_cfgs
+    ]
+    # 上一次收到的原始传感器字符串；载荷未变时沿用 last_levels
+    last_raw: Optional[str] = None
+    # 每个泵最近一次实际发布的状态；状态未变就不再发布（phys_fed 会沿用上一条命令）
+    last_pub: Dict[str, str] = {}
 
     while t < t_end:
         t_next = t + dt
-        granted = h.helicsFederateRequestTime(fed, t_next)
+        granted = request_time(fed, t_next)
         t = float(granted)
 
-        if h.helicsInputIsUpdated(sub):
-            raw = h.helicsInputGetString(sub)
-            try:
-                last_snap = SensorSnapshot.from_dict(json.loads(raw))
-            except Exception:
-                pass
+        if input_is_updated(sub):
+            raw = input_get_string(sub)
+            if raw != last_raw:
+                last_raw = raw
+                try:
+                    tl = json_loads(raw).get("tank_level") or {}
+                    last_levels.update([(str(k), float(v)) for k, v in tl.items()])
+                except Exception:
+                    pass
 
-        level_val = last_snap.tank_level.get(tank_id)
+        level_val = last_levels.get(tank_id)
 
-        for plc in plc_cfgs:
-            pump_name = plc["pump"]
+        for pump_name, below, above, open_val, closed_val, pub, prefix in plc_rules:
             if level_val is None:
                 state = last_state[pump_name]
-            elif level_val < plc["below"]:
-                state = plc["open_val"]
-            elif level_val > plc["above"]:
-                state = plc["closed_val"]
+            elif level_val < below:
+                state = open_val
+            elif level_val > above:
+                state = closed_val
             else:
                 state = last_state[pump_name]
 
             last_state[pump_name] = state
-            cmd = ActuatorCommand(pumps={pump_name: state})
-            pub = pubs.get(pump_name)
-            if pub:
-                h.helicsPublicationPublishString(pub, json.dumps(cmd.to_dict(), ensure_ascii=False))
+            if pub and last_pub.get(pump_name) != state:
+                publish_string(pub, prefix + json_dumps(state, ensure_ascii=False) + "}}")
+                last_pub[pump_name] = state
 
         if step_count % 10 == 0:
             pump_states = ", ".join(f"{p}={s}" for p, s in last_state.items())
-            print(f"[ctrl_fed] t={t}, tank_level[{tank_id}]={level_val}, {pump_states}")
+            log.write(f"[ctrl_fed] t={t}, tank_level[{tank_id}]={level_val}, {pump_states}")
 
         step_count += 1
 
+    log.flush()
+
     # 给 HELICS 一个 flush 的机会，再断开
     h.helicsFederateRequestTime(fed, h.HELICS_TIME_MAXTIME)
     h.helicsFederateDisconnect(fed)
@@ -1,13 +1,15 @@
 from __future__ import annotations
 import json
+from typing import Optional
+
 import helics as h
-import yaml
 
+from common.config import load_config, normalize_pump_entry, normalize_sensor_entry
 from common.schema import SensorSnapshot, ActuatorCommand
 
 
 def run_openplc_federate(config_path: str) -> None:
-    cfg = yaml.safe_load(open(config_path, "r", encoding="utf-8"))
+    cfg = load_config(config_path)
     sim_cfg = cfg.get("sim", {})
     helics_cfg = cfg.get("helics", {})
     dt = float(sim_cfg.get("dt_phys_s"))
@@ -16,15 +18,11 @@ def run_openplc_federate(config_path: str) -> None:
 
     sensors_cfg = cfg.get("sensors", {}).get("tank_level", [])
     sensor_entry = sensors_cfg[0] if sensors_cfg else {}
-    tank_id = sensor_entry.get("tank") if isinstance(sensor_entry, dict) else str(sensor_entry) if sensor_entry else "TANK"
-    sensor_topic = sensor_entry.get("topic") if isinstance(sensor_entry, dict) else None
-    if not sensor_topic:
-        sensor_topic = f"phys/sensors/{tank_id}"
+    tank_id, sensor_topic = normalize_sensor_entry(sensor_entry)
 
     actuators_cfg = cfg.get("actuators", {}).get("pumps", [])
     pump_entry = actuators_cfg[0] if actuators_cfg else {}
-    pump_name = pump_entry.get("pump") if isinstance(pump_entry, dict) else str(pump_entry) if pump_entry else "PUMP1"
-    command_topic = pump_entry.get("topic") if isinstance(pump_entry, dict) else None
+    pump_name, command_topic = normalize_pump_entry(pump_entry, default_pump="PUMP1")
     if not command_topic:
         command_topic = f"ctrl/commands/{pump_name}"
 
@@ -45,31 +43,43 @@ def run_openplc_federate(config_path: str) -> None:
 
     t = 0.0
     last_snap = SensorSnapshot(tank_level={})
+    step_count = 0
+
+    # 热循环里用到的 HELICS/json 函数先绑定到局部名，省掉每步的模块属性查找
+    request_time = h.helicsFederateRequestTime
+    input_is_updated = h.helicsInputIsUpdated
+    input_get_string = h.helicsInputGetString
+    publish_string = h.helicsPublicationPublishString
+    json_loads = json.loads
+    snap_from_dict = SensorSnapshot.from_dict
+    # 只会发布两种载荷，循环外一次性生成
+    open_msg = json.dumps(ActuatorCommand(pumps={pump_name: "OPEN"}).to_dict(), ensure_ascii=False)
+    closed_msg = json.dumps(ActuatorCommand(pumps={pump_name: "CLOSED"}).to_dict(), ensure_ascii=False)
+    # 最近一次实际发布的载荷；未变就不再发布
+    last_msg: Optional[str] = None
 
     while t < t_end:
-        if int(t) % int(dt * 10) == 0:
+        if step_count % 10 == 0:
             print(f"[openplc_fed] t={t}")
 
         t_next = t + dt
-        granted = h.helicsFederateRequestTime(fed, t_next)
+        granted = request_time(fed, t_next)
         t = float(granted)
 
-        if h.helicsInputIsUpdated(sub):
-            raw = h.helicsInputGetString(sub)
+        if input_is_updated(sub):
+            raw = input_get_string(sub)
             try:
-                last_snap = SensorSnapshot.from_dict(json.loads(raw))
+                last_snap = snap_from_dict(json_loads(raw))
             except Exception:
                 pass
 
         level_val = last_snap.tank_level.get(tank_id)
-        pumps_cmd = {}
-        if level_val is not None and level_val < threshold:
-            pumps_cmd[pump_name] = "OPEN"
-        else:
-            pumps_cmd[pump_name] = "CLOSED"
-
-        cmd = ActuatorCommand(pumps=pumps_cmd)
-        h.helicsPublicationPublishString(pub, json.dumps(cmd.to_dict(), ensure_ascii=False))
+        msg = open_msg if level_val is not None and level_val < threshold else closed_msg
+        if msg != last_msg:
+            publish_string(pub, msg)
+            last_msg = msg
+
+        step_count += 1
 
     print("[openplc_fed] finished")
 
@@ -4,29 +4,31 @@ import json
 
 from typing import Any, Dict
 
-import csv
-
 import os
 
 
 
 import helics as h
 
-import yaml
+import numpy as np
+
+
 
+from common.config import load_config, normalize_pump_entry, normalize_sensor_entry
 
+from common.logbuf import BufferedLog
 
-from common.schema import SensorSnapshot, ActuatorCommand
+from common.schema import render_sensor_payload, sensor_payload_format
 
-from phys_fed.wntr_plant import WNTRPlant
+from phys_fed.wntr_plant import WNTRPlant, WNTRSimPlant
 
 
 
 
 
-def run_phys_federate(config_path: str) -> None:
+def run_phys_federate(config_path: str, close_library: bool = True) -> None:
 
-    cfg = yaml.safe_load(open(config_path, "r", encoding="utf-8"))
+    cfg = load_config(config_path)
 
     sim_cfg = cfg.get("sim", {})
 
@@ -36,11 +38,19 @@ def run_phys_federate(config_path: str) -> None:
 
     t_end = float(sim_cfg.get("t_end_s"))
 
+    # 泵命令不变时最多攒多少秒再推进一次 WNTR；默认 = dt，即每步都推进
+
+    max_batch_dt = float(sim_cfg.get("phys_max_batch_s", dt))
+
     broker_port = helics_cfg.get("broker", {}).get("port", 23404)
 
 
 
-    plant = WNTRPlant(
+    # toolkit：EPANET Toolkit 增量推进（默认）；wntr：WNTR 高层 API 每步从 0 重跑（对照/后备）
+
+    plant_cls = WNTRSimPlant if sim_cfg.get("plant_backend", "toolkit") == "wntr" else WNTRPlant
+
+    plant = plant_cls(
 
         inp_path=str(sim_cfg.get("inp_path")),
 
@@ -48,6 +58,8 @@ def run_phys_federate(config_path: str) -> None:
 
         actuators=cfg.get("actuators", {}),
 
+        dt=dt,
+
     )
 
 
@@ -56,17 +68,11 @@ def run_phys_federate(config_path: str) -> None:
 
     sensor_entry = sensors_cfg[0] if sensors_cfg else {}
 
-    tank_id = sensor_entry.get("tank") if isinstance(sensor_entry, dict) else str(sensor_entry) if sensor_entry else "TANK"
-
-    topic_sensors = sensor_entry.get("topic") if isinstance(sensor_entry, dict) else None
-
-    if not topic_sensors:
+    tank_id, topic_sensors = normalize_sensor_entry(sensor_entry)
 
-        topic_sensors = f"phys/sensors/{tank_id}"
 
 
-
-    actuators_cfg = cfg.get("actuators", {}).get("pumps", [])
+    pump_entries = [normalize_pump_entry(pump) for pump in cfg.get("actuators", {}).get("pumps", [])]
 
 
 
@@ -94,11 +100,7 @@ def run_phys_federate(config_path: str) -> None:
 
     subs: Dict[str, h.HelicsInput] = {}
 
-    for pump in actuators_cfg:
-
-        topic = pump.get("topic") if isinstance(pump, dict) else None
-
-        pump_name = pump.get("pump") if isinstance(pump, dict) else str(pump)
+    for pump_name, topic in pump_entries:
 
         if not topic or not pump_name:
 
@@ -114,7 +116,17 @@ def run_phys_federate(config_path: str) -> None:
 
     os.makedirs("output", exist_ok=True)
 
-    records = []
+    # 预分配 t / tank_level 数组按下标写入，结束时一次性 savetxt，代替 list-of-dict + csv.writer
+
+    n_rows = int(t_end / dt) + 2
+
+    rec_t = np.empty(n_rows, dtype=np.int64)
+
+    rec_level = np.empty(n_rows, dtype=np.float64)
+
+    # plant 状态里没有该 tank 的行号；写 CSV 时这些格留空（与原先 csv.writer 写 None 一致）
+
+    missing_rows = []
 
 
 
@@ -122,66 +134,151 @@ def run_phys_federate(config_path: str) -> None:
 
     state0 = plant.reset()
 
-    snap0 = SensorSnapshot(tank_level=state0.tank_level)
+    # tank 集合在整个仿真中固定，传感器 JSON 只需每步填入数值
+
+    sensor_tanks = list(state0.tank_level)
+
+    sensor_fmt = sensor_payload_format(sensor_tanks)
 
-    h.helicsPublicationPublishString(pub, json.dumps(snap0.to_dict(), ensure_ascii=False))
+    h.helicsPublicationPublishString(
 
-    records.append(plant.make_record(t=0, state=state0, tank_id=tank_id))
+        pub, render_sensor_payload(sensor_fmt, sensor_tanks, tuple([float(state0.tank_level[k]) for k in sensor_tanks]))
+
+    )
+
+    rec_t[0] = 0
+
+    level0 = state0.tank_level.get(tank_id)
+
+    if level0 is None:
+
+        missing_rows.append(0)
+
+    rec_level[0] = np.nan if level0 is None else level0
+
+    n_rec = 1
 
 
 
     t = 0.0
 
-    pending_cmd = ActuatorCommand(pumps={})
+    # 合并后的泵命令 {pump: state}，直接用普通 dict，不经过 ActuatorCommand 来回转换
+
+    pending_pumps: Dict[str, Any] = {}
+
+    pending_cmd = {"pumps": pending_pumps}
+
+    # 上一次真正送进 plant.step 的泵命令，以及尚未推进的累计时长
+
+    applied_pumps: Dict[str, Any] = {}
+
+    pending_dt = 0.0
+
+    state = state0
 
     step_count = 0
 
+    log = BufferedLog()
+
 
 
+    # 热循环里用到的 HELICS/json 函数先绑定到局部名，省掉每步的模块属性查找
+    request_time = h.helicsFederateRequestTime
+    input_is_updated = h.helicsInputIsUpdated
+    input_get_string = h.helicsInputGetString
+    publish_string = h.helicsPublicationPublishString
+    json_loads = json.loads
+    # 每个订阅上一次收到的原始字符串；泵命令很少变化，相同载荷无需重复解析
+    last_raw: Dict[str, str] = {}
+
     while t < t_end:
         # 1) 请求到下一时刻
         t_next = t + dt
-        granted = h.helicsFederateRequestTime(fed, t_next)
+        granted = request_time(fed, t_next)
         t = float(granted)
 
         # 2) 读取是否有新命令（若无，则沿用）
         for pump_name, sub in subs.items():
-            if not h.helicsInputIsUpdated(sub):
+            if not input_is_updated(sub):
+                continue
+            raw = input_get_string(sub)
+            if raw == last_raw.get(pump_name):
                 continue
-            raw = h.helicsInputGetString(sub)
+            last_raw[pump_name] = raw
             try:
-                incoming = ActuatorCommand.from_dict(json.loads(raw))
-                for k, v in incoming.pumps.items():
-                    pending_cmd.pumps[k] = v
+                pending_pumps.update(json_loads(raw).get("pumps") or {})
             except Exception:
                 # 保持上一条有效命令
                 pass
 
-        # 3) 推进物理一步
-        state = plant.step(dt=dt, cmd=pending_cmd.to_dict())
+        # 3) 推进物理：命令没变时先攒着，命令变化 / 攒满 max_batch_dt / 到终点时再一次推进
+        pending_dt += dt
+        cmd_changed = pending_pumps != applied_pumps
+        if cmd_changed and pending_dt > dt:
+            # 先用旧命令把之前攒下的区间推进完，新命令只作用于本步
+            plant.step(dt=pending_dt - dt, cmd={"pumps": applied_pumps})
+            pending_dt = dt
+        if cmd_changed or pending_dt >= max_batch_dt or t >= t_end:
+            state = plant.step(dt=pending_dt, cmd=pending_cmd)
+            pending_dt = 0.0
+            applied_pumps = dict(pending_pumps)
+            # 攒批推进后 plant 时钟必须与 HELICS 时刻对齐，否则后续观测都会错位
+            if abs(plant.sim_time - t) > 1e-6:
+                msg = f"[phys_fed] plant time {plant.sim_time} drifted from HELICS time {t}"
+                # 全局错误让 broker 终止整个联合仿真，其他 federate 不会卡在 requestTime 上
+                h.helicsFederateGlobalError(fed, 1, msg)
+                raise RuntimeError(msg)
+        # 否则沿用上一次的观测值（零阶保持）
 
         # 4) 发布传感器快照
-        snap = SensorSnapshot(tank_level=state.tank_level)
-        h.helicsPublicationPublishString(pub, json.dumps(snap.to_dict(), ensure_ascii=False))
-        records.append(plant.make_record(t=int(t), state=state, tank_id=tank_id))
+        levels = state.tank_level
+        publish_string(pub, render_sensor_payload(sensor_fmt, sensor_tanks, tuple([float(levels[k]) for k in sensor_tanks])))
+        if n_rec == n_rows:
+            # HELICS 给出的时刻比请求的更密时才会走到这里
+            n_rows *= 2
+            rec_t = np.resize(rec_t, n_rows)
+            rec_level = np.resize(rec_level, n_rows)
+        rec_t[n_rec] = int(t)
+        level = levels.get(tank_id)
+        if level is None:
+            missing_rows.append(n_rec)
+            level = np.nan
+        rec_level[n_rec] = level
+        n_rec += 1
 
         if step_count % 10 == 0:
             level_val = state.tank_level.get(tank_id, None)
-            print(f"[phys_fed] t={t}, tank_level[{tank_id}]={level_val}")
+            log.write(f"[phys_fed] t={t}, tank_level[{tank_id}]={level_val}")
         step_count += 1
 
+    log.flush()
+
     # 结束前让 HELICS 有机会把数据发完
     h.helicsFederateRequestTime(fed, h.HELICS_TIME_MAXTIME)
     h.helicsFederateDisconnect(fed)
     print("[phys_fed] finished")
 
     out_path = os.path.join("output", "helics_phys_tank.csv")
-    with open(out_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["t", "tank_level"])
-        for row in records:
-            writer.writerow([row["t"], row["tank_level"]])
+    level_col = rec_level[:n_rec]
+    if missing_rows:
+        # 转成 object 列后缺失格填 ""，"%s" 会写出空单元格
+        level_col = level_col.astype(object)
+        level_col[missing_rows] = ""
+    # %d / %s 与原先 csv.writer 对 int / float 的输出一致；行尾沿用 csv 默认的 \r\n
+    np.savetxt(
+        out_path,
+        np.column_stack([rec_t[:n_rec], level_col]),
+        fmt=["%d", "%s"],
+        delimiter=",",
+        newline="\r\n",
+        header="t,tank_level",
+        comments="",
+    )
     print(f"[phys_fed] wrote {out_path}")
 
+    plant.close()
+
     h.helicsFederateFree(fed)
-    h.helicsCloseLibrary()
+    # 与其他 federate 同进程运行时由调用方统一关闭 HELICS 库
+    if close_library:
+        h.helicsCloseLibrary()
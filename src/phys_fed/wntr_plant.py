@@ -1,402 +1,581 @@
 from __future__ import annotations
-
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-
-from typing import Dict, Any, List, Optional
-
+from itertools import repeat
+from typing import Dict, Any, Iterator, List, Optional
+from wntr.epanet.toolkit import ENepanet
+from wntr.epanet.util import EN
 from wntr.network.base import LinkStatus
 
+import csv
+import ctypes
+import os
+import tempfile
+import numpy as np
+import wntr
 
 
-import os
+# link status 码 -> 字符串。LinkStatus 重载了 __eq__ 而不可 hash，所以按 int 值做 key
+_STATUS_NAMES: Dict[int, str] = {
+    int(LinkStatus.Opened): "OPEN",
+    int(LinkStatus.Closed): "CLOSED",
+    int(LinkStatus.Active): "ACTIVE",
+}
 
-import wntr
+# 泵命令原始值 -> EN_STATUS 取值（1 开 / 0 关）。常见的已规范化输入直接命中，
+# 其它写法再退回 str().upper() 查一次
+_CMD_MAP: Dict[Any, int] = {v: 1 for v in ("OPEN", "1", "ON", "TRUE", 1, True, "open", "on")}
+_CMD_MAP.update({v: 0 for v in ("CLOSED", "0", "OFF", "FALSE", 0, False, "closed", "off")})
 
 
+def _pump_cmd_value(state: Any) -> Optional[int]:
+    """
+    泵命令 -> 1 / 0，无法识别时返回 None（该泵保持原状态）。
+    只有 str/int/bool 走直接查表：1.0 == 1 哈希相同，浮点命令若也直接查会被当成开/关，
+    而按 str().upper() 规则 "1.0" 并不是合法命令。
+    """
+    val = _CMD_MAP.get(state) if type(state) in (str, int, bool) else None
+    if val is None:
+        val = _CMD_MAP.get(str(state).upper())
+    return val
 
 
+def _tank_levels(heads: np.ndarray, elevations: np.ndarray) -> np.ndarray:
+    """tank 水位 = head - 标高（逐元素）"""
+    return heads - elevations
 
-@dataclass
 
-class WNTRState:
+# 观测对象（tank + pump）不超过这个数时为每个 plant 生成直线展开的 _observe；
+# 更大的网络走 numpy 的批量路径，避免生成过长的函数
+_OBSERVE_CODEGEN_MAX = 64
 
-    # 你可以后续扩展 pressure/flow 等
 
-    tank_level: Dict[str, float]
+# 已确认存在的输出目录；同一目录反复写记录（如批量场景逐个导出）时不再重复 makedirs/stat
+_ensured_dirs = set()
 
-    pump_status: Dict[str, str] = field(default_factory=dict)
 
+def _ensure_dir(path: str) -> None:
+    if path and path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
 
 
+@dataclass
+class WNTRState:
+    # 你可以后续扩展 pressure/flow 等
+    tank_level: Dict[str, float]
+    pump_status: Dict[str, str] = field(default_factory=dict)
 
 
-class WNTRPlant:
+class _PlantBase:
+    """两种 plant 实现共用的部分：tank/pump 名称解析、记录打平与 CSV 输出、status 转字符串"""
 
     def __init__(self, inp_path: str, sensors: Dict[str, Any], actuators: Dict[str, Any]):
-
         if not os.path.exists(inp_path):
-
             raise FileNotFoundError(f"WNTR inp not found: {inp_path}")
 
-
-
         self.inp_path = inp_path
-
-        self.wn = wntr.network.WaterNetworkModel(inp_path)
-
         self.sensors = sensors
-
         self.actuators = actuators
 
-
-
         # 预解析出 tank/pump 名称，兼容 {"tank_level": [{"tank": "TANK"}]} 或直接字符串列表
-
         self._tank_names = []
-
         for entry in self.sensors.get("tank_level", []):
-
             if isinstance(entry, dict):
-
                 name = entry.get("tank") or entry.get("id") or entry.get("name")
-
             else:
-
                 name = entry
-
             if name:
-
                 self._tank_names.append(str(name))
 
-
-
         self._pump_names = []
-
         for entry in self.actuators.get("pumps", []):
-
             if isinstance(entry, dict):
-
                 name = entry.get("pump") or entry.get("id") or entry.get("name")
-
             else:
-
                 name = entry
-
             if name:
-
                 self._pump_names.append(str(name))
-
-
+        # 命令循环里做成员判断用，O(1) 查找
+        self._pump_names_set = frozenset(self._pump_names)
 
         self.sim_time = 0.0
-
         self._last_cmd: Dict[str, Any] = {"pumps": {}}
-
+        # 上一次写进水力/报表步长的 dt；dt 在一次运行里基本不变，没变就不重复设置
+        self._last_dt: Optional[float] = None
+        self._dt_i = 0
         self._default_tank: Optional[str] = self._tank_names[0] if self._tank_names else None
 
+    def make_record(self, t: int, state: WNTRState, tank_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        将当前状态打平为一行记录，便于写入 CSV，格式类似 baseline：
+          {"t": 0, "tank_level": 1.23, "PUMP1_status": "OPEN", ...}
+        """
+        tank_key = tank_id or self._default_tank
+        row: Dict[str, Any] = {"t": int(t)}
+        row["tank_level"] = state.tank_level.get(tank_key, None) if tank_key else None
+        for pump in self._pump_names:
+            row[f"{pump}_status"] = state.pump_status.get(pump, "UNKNOWN")
+        return row
 
+    @contextmanager
+    def open_records_writer(self, out_path: str) -> Iterator["_RecordsWriter"]:
+        """
+        流式写 CSV：打开文件并写好表头，逐步 append(t, state) 一行写一行，
+        不必先把整段仿真的记录攒成 List[Dict] 再统一写出。
+        """
+        _ensure_dir(os.path.dirname(out_path))
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            yield _RecordsWriter(csv.writer(f), self._pump_names, self._default_tank)
 
-    def reset(self) -> WNTRState:
-
-        self.sim_time = 0.0
+    def write_records_csv(self, records: List[Dict[str, Any]], out_path: str) -> None:
+        """按照 baseline 形式写出 CSV：t, tank_level, <pump>_status...（兼容旧接口，内部走流式写）"""
+        with self.open_records_writer(out_path) as w:
+            w.extend(records)
 
-        # WNTR 的“状态”通常通过运行仿真得到；最小实现：先跑 0~dt 或直接读初值
+    @staticmethod
+    def _status_to_str(val: Any) -> str:
+        # LinkStatus 枚举（IntEnum）/ 数值 / 字符串 -> OPEN/CLOSED/ACTIVE 字符串
+        if isinstance(val, int):
+            return _STATUS_NAMES.get(int(val)) or str(val)
+        if isinstance(val, str):
+            return val.upper()
 
-        # 这里先直接读 tank 初始水位（如果存在）
+        try:
+            ival = int(round(float(val)))
+        except Exception:
+            return "UNKNOWN" if val is None else str(val)
+        return _STATUS_NAMES.get(ival) or str(val)
+
+
+class _RecordsWriter:
+    """open_records_writer 返回的写入器，列顺序与 make_record 一致：t, tank_level, <pump>_status..."""
+
+    def __init__(self, writer, pump_names: List[str], tank_id: Optional[str]):
+        self._writer = writer
+        self._pump_names = list(pump_names)
+        self._tank_id = tank_id
+        self.cols = ["t", "tank_level", *[f"{p}_status" for p in self._pump_names]]
+        # 每行复用同一个 list，避免逐步新建 dict/list
+        self._row: List[Any] = [None] * len(self.cols)
+        writer.writerow(self.cols)
+
+    def append(self, t: int, state: WNTRState) -> None:
+        row = self._row
+        row[0] = int(t)
+        row[1] = state.tank_level.get(self._tank_id, None) if self._tank_id else None
+        get = state.pump_status.get
+        for i, pump in enumerate(self._pump_names, 2):
+            row[i] = get(pump, "UNKNOWN")
+        self._writer.writerow(row)
+
+    def extend(self, records: List[Dict[str, Any]]) -> None:
+        """写入 make_record 产出的记录行，缺失的列留空"""
+        cols = self.cols
+        self._writer.writerows([[rec.get(col, "") for col in cols] for rec in records])
+
+
+class WNTRPlant(_PlantBase):
+    """
+    基于 EPANET Toolkit 的增量仿真：工程只 ENopen 一次，水力计算通过
+    ENopenH / ENinitH / ENrunH / ENnextH 连续推进，每次 step 只算 dt 秒，
+    而不是每步都从 0 重跑到当前时刻。
+    """
+
+    def __init__(self, inp_path: str, sensors: Dict[str, Any], actuators: Dict[str, Any], dt: Optional[float] = None):
+        super().__init__(inp_path, sensors, actuators)
+
+        # rpt/bin 放在同一个临时目录里，close() 时一起清理，避免在工作目录留下文件
+        self._tmpdir = tempfile.TemporaryDirectory(prefix="wntr_plant_")
+        self.en = ENepanet()
+        self.en.ENopen(
+            inp_path,
+            os.path.join(self._tmpdir.name, "plant.rpt"),
+            os.path.join(self._tmpdir.name, "plant.bin"),
+        )
+        self._opened = False
+        # 泵当前的 EN_STATUS（1 开 / 0 关），每次观测时刷新，用于跳过重复的泵命令
+        self._current_pump_status: Dict[str, int] = {}
+
+        # 元数据（下标、标高）全部由 Toolkit 查询，不再用 WNTR 的 Python 解析器构建 WaterNetworkModel
+        # 名称 -> Toolkit 下标只查一次；网络里不存在的名字直接跳过（观测时给默认值）
+        self.idx_map: Dict[str, Dict[str, int]] = {"nodes": {}, "links": {}}
+        for name in self._tank_names:
+            try:
+                self.idx_map["nodes"][name] = self.en.ENgetnodeindex(name)
+            except Exception:
+                pass
+        for name in self._pump_names:
+            try:
+                self.idx_map["links"][name] = self.en.ENgetlinkindex(name)
+            except Exception:
+                pass
+        self.elevations: Dict[str, float] = {
+            name: self.en.ENgetnodevalue(idx, EN.ELEVATION) for name, idx in self.idx_map["nodes"].items()
+        }
+        self._duration = self.en.ENgettimeparam(EN.DURATION)
+
+        # 观测用的下标 / 标高一次排成连续数组；网络里没有的 tank 不在数组里，观测时给默认值 0.0
+        self._tank_obs_names = [n for n in self._tank_names if n in self.idx_map["nodes"]]
+        self._tank_idx_arr = np.array([self.idx_map["nodes"][n] for n in self._tank_obs_names], dtype=np.int32)
+        self._tank_elev_arr = np.array([self.elevations[n] for n in self._tank_obs_names], dtype=np.float64)
+        self._pump_obs = [(n, self.idx_map["links"].get(n)) for n in self._pump_names]
+        self._read_node, self._read_link = self._bind_value_readers()
+        if len(self._tank_names) + len(self._pump_names) <= _OBSERVE_CODEGEN_MAX:
+            # 实例属性覆盖同名方法，reset/step 里的 self._observe() 直接调用生成的版本
+            self._observe = self._build_observe()
+        if dt is not None:
+            self._set_timestep(dt)
+
+    def _set_timestep(self, dt: float) -> None:
+        """水力/报表步长对齐 dt，保证 ENnextH 会停在每个 step 的边界上"""
+        self._dt_i = int(round(dt))
+        # 先设 REPORTSTEP：EPANET 会把 HYDSTEP 截到 min(PATTERNSTEP, REPORTSTEP)，
+        # 反过来设的话 dt 变大时 HYDSTEP 会停在旧值。已排好的下一个报表时刻不会随之改变，
+        # 由 step() 里按剩余时长截断 HYDSTEP 来保证停在目标时刻
+        self.en.ENsettimeparam(EN.REPORTSTEP, self._dt_i)
+        self.en.ENsettimeparam(EN.HYDSTEP, self._dt_i)
+        self._last_dt = dt
+
+    def _bind_value_readers(self):
+        """
+        直接绑定 libepanet 的 EN_getnodevalue / EN_getlinkvalue，复用同一个 c_double 出参，
+        省掉 ENepanet wrapper 每次调用新建 ctypes 对象和 _error 检查的开销。
+        返回非 0 错误码时退回 wrapper 再调一次，由它负责告警 / 抛 EpanetException。
+        """
+        en = self.en
+        project = getattr(en, "_project", None)
+        if project is None:
+            # 旧版单工程 API（出参是 float），直接用 wrapper
+            return en.ENgetnodevalue, en.ENgetlinkvalue
+
+        # 按 EPANET 2.2 的签名 int EN_get*value(EN_Project, int, int, double*) 单独建带原型的函数指针：
+        # 不去改 ENlib 上共享的函数对象（wrapper 自己传的是 c_uint64 句柄，设了 argtypes 会被拒）
+        functype = ctypes.WINFUNCTYPE if os.name in ("nt", "dos") else ctypes.CFUNCTYPE
+        proto = functype(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_double))
+        get_node = proto(("EN_getnodevalue", en.ENlib))
+        get_link = proto(("EN_getlinkvalue", en.ENlib))
+        handle = project.value
+
+        out = ctypes.c_double()
+        out_ref = ctypes.byref(out)
+
+        def read_node(idx: int, code: int) -> float:
+            if get_node(handle, idx, code, out_ref):
+                return en.ENgetnodevalue(idx, code)
+            return out.value
+
+        def read_link(idx: int, code: int) -> float:
+            if get_link(handle, idx, code, out_ref):
+                return en.ENgetlinkvalue(idx, code)
+            return out.value
+
+        return read_node, read_link
+
+    def _build_observe(self):
+        """
+        观测的 tank/pump 集合在 plant 生命周期内固定，这里把通用 _observe 的循环按配置展开成
+        直线代码再 exec：下标、标高、名字都成了常量，每次观测只剩 FFI 读取和一次 dict 字面量构造。
+        结果与 _observe() 逐位一致（同样是 head - elevation 的 float64 减法）。
+        """
+        ns: Dict[str, Any] = {
+            "read_node": self._read_node,
+            "read_link": self._read_link,
+            "to_str": self._status_to_str,
+            "current": self._current_pump_status,
+            "WNTRState": WNTRState,
+            "HEAD": EN.HEAD,
+            "STATUS": EN.STATUS,
+        }
+        body: List[str] = []
+        levels: List[str] = []
+        for i, name in enumerate(self._tank_names):
+            idx = self.idx_map["nodes"].get(name)
+            if idx is None:
+                levels.append(f"{name!r}: 0.0")
+                continue
+            ns[f"e{i}"] = self.elevations[name]
+            body.append(f"    h{i} = read_node({idx}, HEAD)")
+            levels.append(f"{name!r}: h{i} - e{i}")
+        statuses: List[str] = []
+        for i, (name, idx) in enumerate(self._pump_obs):
+            if idx is None:
+                statuses.append(f"{name!r}: 'UNKNOWN'")
+                continue
+            body.append(f"    s{i} = read_link({idx}, STATUS)")
+            body.append(f"    current[{name!r}] = int(s{i})")
+            statuses.append(f"{name!r}: to_str(s{i})")
+        src = "\n".join([
+            "def _observe():",
+            *body,
+            "    return WNTRState(tank_level={%s}, pump_status={%s})" % (", ".join(levels), ", ".join(statuses)),
+        ])
+        exec(compile(src, f"<WNTRPlant._observe {self.inp_path}>", "exec"), ns)
+        return ns["_observe"]
 
+    def reset(self) -> WNTRState:
+        # 水力模块只 ENopenH 一次；再次 reset 时 ENinitH 就会把时间、tank 水位和 link 状态
+        # 恢复成 INP 初值，不需要 ENcloseH / ENopenH 重新分配求解器
+        if not self._opened:
+            self.en.ENopenH()
+            self._opened = True
+        # flag=10：不存结果文件，并重新初始化管段流量，否则牛顿迭代会从上一轮末尾的流量起步，
+        # 多次 reset 的结果会有微小差异。ENinitH 已把 tank 水位置为初值，这里不需要额外 ENrunH 求解
+        self.en.ENinitH(10)
+        self.sim_time = 0.0
+        self._current_pump_status.clear()
         return self._observe()
 
-
-
     def step(self, dt: float, cmd: Dict[str, Any]) -> WNTRState:
-
         """
-
         推进物理一步：
-
-        - 应用泵的 OPEN/CLOSED
-
-        - 将 EPANET/WNTR 仿真推进到 self.sim_time + dt（通过设置 duration）
-
-        - 从 results 中取目标时刻的 TANK level（head - elevation）
-
+        - 用 ENsetlinkvalue(EN_STATUS) 应用泵的 OPEN/CLOSED
+        - ENrunH / ENnextH 从 self.sim_time 连续推进到 self.sim_time + dt
+        - 读取目标时刻的 TANK level（head - elevation）
         """
-
         self._last_cmd = cmd or {"pumps": {}}
 
-
-
-        # 1) 应用泵命令到 wn
-
+        # 1) 应用泵命令
         pumps_cmd = (self._last_cmd.get("pumps") or {}) if isinstance(self._last_cmd, dict) else {}
-
+        current = self._current_pump_status
         for pump_name, state in pumps_cmd.items():
-
-            if pump_name not in self._pump_names:
-
+            if pump_name not in self._pump_names_set:
+                continue
+            link_idx = self.idx_map["links"].get(pump_name)
+            if link_idx is None:
                 continue
 
-            try:
+            val = _pump_cmd_value(state)
+            # 与当前状态相同的命令（上游每步重复下发 OPEN 之类）不再调用 ENsetlinkvalue
+            if val is None or current.get(pump_name) == val:
+                continue
+            self.en.ENsetlinkvalue(link_idx, EN.STATUS, val)
+            current[pump_name] = val
+
+        # 2) 目标时刻；超出 INP 的 duration 时顺延，否则 ENnextH 会提前返回 0
+        target_t = int(round(self.sim_time + float(dt)))
+        if target_t > self._duration:
+            self.en.ENsettimeparam(EN.DURATION, target_t)
+            self._duration = target_t
+        if dt != self._last_dt:
+            self._set_timestep(dt)
+
+        # 3) 按 Toolkit 的标准顺序 ENrunH -> ENnextH 推进到 target_t：
+        #    每个子区间开头求解一次（已包含刚下发的泵状态），ENnextH 再用这组流量积分 tank 水位。
+        #    不在 target_t 处再补一次 ENrunH —— 下一次 step 开头会在同一时刻求解，补了就是重复计算。
+        #    因此返回时 tank 水位对应 target_t，泵状态对应最后一个子区间开头的求解结果。
+        #    dt 变化后 EPANET 的下一个报表时刻仍按旧 REPORTSTEP 排着，ENnextH 可能越过 target_t，
+        #    所以剩余时长不足一个 HYDSTEP 时先把 HYDSTEP 截到剩余时长，推进完再恢复。
+        hyd_time = int(round(self.sim_time))
+        hydstep = self._dt_i
+        while hyd_time < target_t:
+            t_solved = self.en.ENrunH()
+            remaining = target_t - t_solved
+            if remaining < hydstep:
+                hydstep = remaining
+                self.en.ENsettimeparam(EN.HYDSTEP, hydstep)
+            tstep = self.en.ENnextH()
+            if tstep <= 0:
+                break
+            hyd_time = t_solved + tstep
+        if hydstep != self._dt_i:
+            self.en.ENsettimeparam(EN.HYDSTEP, self._dt_i)
+        self.sim_time = float(hyd_time)
 
-                pump = self.wn.get_link(pump_name)
+        return self._observe()
 
-            except Exception:
+    def close(self) -> None:
+        if self.en is None:
+            return
+        if self._opened:
+            self.en.ENcloseH()
+            self._opened = False
+        self.en.ENclose()
+        self.en = None
+        self._read_node = self._read_link = None
+        # 生成的 _observe 里还拿着已关闭工程的读取函数，一起丢掉
+        self.__dict__.pop("_observe", None)
+        self._tmpdir.cleanup()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
+    def _observe(self) -> WNTRState:
+        read_link, to_str, status = self._read_link, self._status_to_str, EN.STATUS
+        # map 在 C 层逐个调用 read_node，结果直接落进 float64 数组，再整体减标高
+        n = len(self._tank_idx_arr)
+        heads = np.fromiter(map(self._read_node, self._tank_idx_arr.tolist(), repeat(EN.HEAD)), dtype=np.float64, count=n)
+        tank_level: Dict[str, float] = dict.fromkeys(self._tank_names, 0.0)
+        tank_level.update(zip(self._tank_obs_names, _tank_levels(heads, self._tank_elev_arr).tolist()))
+        pump_status: Dict[str, str] = {}
+        current = self._current_pump_status
+        for name, idx in self._pump_obs:
+            if idx is None:
+                pump_status[name] = "UNKNOWN"
                 continue
+            raw = read_link(idx, status)
+            current[name] = int(raw)
+            pump_status[name] = to_str(raw)
+        return WNTRState(tank_level=tank_level, pump_status=pump_status)
 
 
+class WNTRSimPlant(_PlantBase):
+    """
+    基于 WNTR 高层 API（EpanetSimulator）的实现：每步把 duration 设为当前时刻并从 0 重跑。
+    O(N²) 的总水力计算量，只作为不直接调用 Toolkit 时的可移植后备 / 对照实现。
+    """
 
-            s = str(state).upper()
+    def __init__(self, inp_path: str, sensors: Dict[str, Any], actuators: Dict[str, Any], dt: Optional[float] = None):
+        super().__init__(inp_path, sensors, actuators)
+        self.wn = wntr.network.WaterNetworkModel(inp_path)
 
-            if s in ("OPEN", "1", "ON", "TRUE"):
+        # tank 标高 / 初始水位在整个仿真中不变，只从 wn 里取一次
+        self._tank_elevations: Dict[str, float] = {}
+        self._tank_init_levels: Dict[str, float] = {}
+        for tank_name in self._tank_names:
+            try:
+                tank = self.wn.get_node(tank_name)
+            except Exception:
+                continue
+            self._tank_elevations[tank_name] = float(getattr(tank, "elevation", 0.0))
+            # WNTR tank 有 init_level 属性（可能为 None）
+            lvl = getattr(tank, "init_level", None)
+            self._tank_init_levels[tank_name] = float(lvl) if lvl is not None else 0.0
 
-                pump.initial_status = LinkStatus.Opened
+        # 模拟器只建一次：run_sim 每次都按 self.wn 的当前状态重写 INP，改过的泵状态/时长照样生效；
+        # 复用同一个实例也就复用了它的结果读取器（BinFile）。初始化开销摊到整个运行上，
+        # 与批量运行时只初始化一次能把 12.6s 降到 0.06s 的经验一致
+        self._sim = wntr.sim.EpanetSimulator(self.wn)
+        if dt is not None:
+            self._set_timestep(dt)
 
-            elif s in ("CLOSED", "0", "OFF", "FALSE"):
+    def _set_timestep(self, dt: float) -> None:
+        # 让报表步长/水力步长更贴合你的 dt（可选，但建议）
+        self._dt_i = int(round(dt))
+        try:
+            self.wn.options.time.hydraulic_timestep = self._dt_i
+            self.wn.options.time.report_timestep = self._dt_i
+        except Exception:
+            pass
+        self._last_dt = dt
 
-                pump.initial_status = LinkStatus.Closed
+    def reset(self) -> WNTRState:
+        self.sim_time = 0.0
+        # WNTR 的“状态”通常通过运行仿真得到；最小实现：先跑 0~dt 或直接读初值
+        # 这里先直接读 tank 初始水位（如果存在）
+        return self._observe()
 
+    def step(self, dt: float, cmd: Dict[str, Any]) -> WNTRState:
+        """
+        推进物理一步：
+        - 应用泵的 OPEN/CLOSED
+        - 将 EPANET/WNTR 仿真推进到 self.sim_time + dt（通过设置 duration）
+        - 从 results 中取目标时刻的 TANK level（head - elevation）
+        """
+        self._last_cmd = cmd or {"pumps": {}}
 
+        # 1) 应用泵命令到 wn
+        pumps_cmd = (self._last_cmd.get("pumps") or {}) if isinstance(self._last_cmd, dict) else {}
+        for pump_name, state in pumps_cmd.items():
+            if pump_name not in self._pump_names_set:
+                continue
+            try:
+                pump = self.wn.get_link(pump_name)
+            except Exception:
+                continue
 
-        # 2) 推进时间
+            val = _pump_cmd_value(state)
+            if val is not None:
+                pump.initial_status = LinkStatus.Opened if val else LinkStatus.Closed
 
+        # 2) 推进时间
         self.sim_time += float(dt)
-
         target_t = int(round(self.sim_time))
 
-
-
         # 3) 设置仿真只跑到 target_t
-
         #    注意：这里是最小可行做法（每步重跑 0..target_t），先求正确性再谈性能/连续状态
-
         self.wn.options.time.duration = target_t
-
-        # 让报表步长/水力步长更贴合你的 dt（可选，但建议）
-
-        try:
-
-            self.wn.options.time.hydraulic_timestep = int(round(dt))
-
-            self.wn.options.time.report_timestep = int(round(dt))
-
-        except Exception:
-
-            pass
-
-
+        # 水力/报表步长固定为基础步长（构造时给的 dt，否则第一次 step 的 dt）。phys_fed 攒批推进时
+        # 只改 duration：若跟着批长改成更粗的报表网格从 0 重跑，target_t 处可能没有结果行，
+        # _row_at 只能取到更早的一行
+        if self._last_dt is None:
+            self._set_timestep(dt)
 
         # 4) 运行仿真并抽取 target_t 时刻的状态
-
-        sim = wntr.sim.EpanetSimulator(self.wn)
-
-        results = sim.run_sim()
-
-
+        results = self._sim.run_sim()
 
         return self._observe_from_results(results, target_t)
 
-
-
-    def make_record(self, t: int, state: WNTRState, tank_id: Optional[str] = None) -> Dict[str, Any]:
-
-        """
-
-        将当前状态打平为一行记录，便于写入 CSV，格式类似 baseline：
-
-          {"t": 0, "tank_level": 1.23, "PUMP1_status": "OPEN", ...}
-
-        """
-
-        tank_key = tank_id or self._default_tank
-
-        row: Dict[str, Any] = {"t": int(t)}
-
-        row["tank_level"] = state.tank_level.get(tank_key, None) if tank_key else None
-
-        for pump in self._pump_names:
-
-            row[f"{pump}_status"] = state.pump_status.get(pump, "UNKNOWN")
-
-        return row
-
-
-
-    def write_records_csv(self, records: List[Dict[str, Any]], out_path: str) -> None:
-
-        """按照 baseline 形式写出 CSV：t, tank_level, <pump>_status..."""
-
-        import csv
-
-        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-
-        pump_cols = [f"{p}_status" for p in self._pump_names]
-
-        with open(out_path, "w", encoding="utf-8", newline="") as f:
-
-            writer = csv.writer(f)
-
-            writer.writerow(["t", "tank_level", *pump_cols])
-
-            for row in records:
-
-                writer.writerow([row.get("t", ""), row.get("tank_level", ""), *[row.get(col, "") for col in pump_cols]])
-
-
-
-
+    def close(self) -> None:
+        pass
 
     def _observe(self) -> WNTRState:
-
         # 读取 tanks 的初始水位（若 WNTR 模型里可取）
-
         tank_level: Dict[str, float] = {}
-
         pump_status: Dict[str, str] = {}
-
         for tank_name in self._tank_names:
-
-            tank = self.wn.get_node(tank_name)
-
-            # WNTR tank 有 init_level 属性（可能为 None）
-
-            lvl = getattr(tank, "init_level", None)
-
-            tank_level[tank_name] = float(lvl) if lvl is not None else 0.0
-
+            tank_level[tank_name] = self._tank_init_levels[tank_name]
         for pump_name in self._pump_names:
-
             try:
-
                 pump = self.wn.get_link(pump_name)
-
                 pump_status[pump_name] = self._status_to_str(getattr(pump, "initial_status", None))
-
             except Exception:
-
                 pump_status[pump_name] = "UNKNOWN"
-
         return WNTRState(tank_level=tank_level, pump_status=pump_status)
 
-
-
     def _observe_from_results(self, results, target_t: int) -> WNTRState:
-
         tank_level: Dict[str, float] = {}
-
         pump_status: Dict[str, str] = {}
-
-        head_df = results.node["head"] if hasattr(results, "node") and "head" in results.node else None
+        # 目标时刻的 head / status 行各转成一次 dict，后面按名字取值都是普通 dict 查找
+        head_df = getattr(results, "node", {}).get("head")
+        status_df = getattr(results, "link", {}).get("status")
+        head_row = self._row_at(head_df, target_t)
+        status_row = self._row_at(status_df, target_t)
+        heads = head_row.to_dict() if head_row is not None else {}
+        statuses = status_row.to_dict() if status_row is not None else {}
 
         for tank_name in self._tank_names:
-
             level_val = 0.0
-
-            if head_df is not None and tank_name in head_df.columns:
-
-                series = head_df[tank_name]
-
-                idx = series.index.get_indexer([target_t], method="nearest")
-
-                if idx.size > 0 and idx[0] != -1:
-
-                    try:
-
-                        head_val = float(series.iloc[idx[0]])
-
-                        elev = float(getattr(self.wn.get_node(tank_name), "elevation", 0.0))
-
-                        level_val = head_val - elev
-
-                    except Exception:
-
-                        level_val = 0.0
-
+            head = heads.get(tank_name)
+            elev = self._tank_elevations.get(tank_name)
+            if head is not None and elev is not None:
+                try:
+                    level_val = float(head) - elev
+                except Exception:
+                    level_val = 0.0
             tank_level[tank_name] = level_val
 
-
-        status_df = results.link["status"] if hasattr(results, "link") and "status" in results.link else None
-
         for pump_name in self._pump_names:
-
             status_val_str = "UNKNOWN"
-
             if status_df is not None and pump_name in status_df.columns:
-
-                series = status_df[pump_name]
-
-                idx = series.index.get_indexer([target_t], method="nearest")
-
-                if idx.size > 0 and idx[0] != -1:
-
-                    status_val_str = self._status_to_str(series.iloc[idx[0]])
-
+                if pump_name in statuses:
+                    status_val_str = self._status_to_str(statuses[pump_name])
             else:
-
                 try:
-
                     pump = self.wn.get_link(pump_name)
-
                     status_val_str = self._status_to_str(getattr(pump, "initial_status", None))
-
                 except Exception:
-
                     status_val_str = "UNKNOWN"
-
             pump_status[pump_name] = status_val_str
 
-
         return WNTRState(tank_level=tank_level, pump_status=pump_status)
 
-
-
     @staticmethod
-
-    def _status_to_str(val: Any) -> str:
-
-        # LinkStatus 枚举或数值 -> OPEN/CLOSED/ACTIVE 字符串
-
-        if isinstance(val, str):
-
-            return val.upper()
-
-
-        if isinstance(val, LinkStatus):
-
-            if val == LinkStatus.Opened:
-
-                return "OPEN"
-
-            if val == LinkStatus.Closed:
-
-                return "CLOSED"
-
-            if val == LinkStatus.Active:
-
-                return "ACTIVE"
-
-            return str(val)
-
-
-        try:
-
-            ival = int(round(float(val)))
-
-        except Exception:
-
-            return "UNKNOWN" if val is None else str(val)
-
-
-        if ival == int(LinkStatus.Opened):
-
-            return "OPEN"
-
-        if ival == int(LinkStatus.Closed):
-
-            return "CLOSED"
-
-        if ival == int(LinkStatus.Active):
-
-            return "ACTIVE"
-
-        return str(val)
+    def _row_at(df, target_t: int):
+        """
+        取 results 中 target_t 时刻的那一行。duration 设为 target_t 且报表步长 = dt 时
+        就是最后一行，直接按位置取；否则在有序 index 上 searchsorted 找最近的一行，
+        与前后两行等距时和 pandas 的 get_indexer(method="nearest") 一样取后一行。
+        """
+        if df is None or len(df.index) == 0:
+            return None
+        times = df.index.values
+        if times[-1] == target_t:
+            return df.iloc[-1]
+        pos = int(times.searchsorted(target_t))
+        if pos >= len(times) or (pos > 0 and target_t - times[pos - 1] < times[pos] - target_t):
+            pos -= 1
+        return df.iloc[pos]